@@ -1,33 +1,58 @@
+import math
 import pandas as pd
 import numpy as np
-from sklearn.preprocessing import StandardScaler
 from sklearn.cluster import AgglomerativeClustering
 from scipy.cluster.hierarchy import linkage
 import statsmodels.api as sm
 from scipy.optimize import minimize
 
+# Numba is optional: without it the kernels below simply run as plain Python
+try:
+    from numba import njit, prange
+except ImportError:
+    prange = range
+    
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+# fastcluster's Ward linkage avoids building the n x n distance matrix; fall back to SciPy
+try:
+    from fastcluster import linkage_vector
+except ImportError:
+    linkage_vector = None
+
 # ==============================================================================
 # PART A: CLUSTERING ANALYSIS (ALIGNED WITH TEACHING NOTE)
 # ==============================================================================
 
 # Load and Clean Clustering Data
 try:
-    # Load data, skipping initial rows to get to the correct headers/data
-    df_raw = pd.read_excel('Clustering_Raw_data.xlsx', header=None)
-    
     # Manually assign column names based on the file's structure
-    data = df_raw.iloc[4:].copy()
-    data.columns = [
+    column_names = [
         'Store_Id', 'Store_Area', 'Zone',
         'Sales_Total', 'Sales_Crescent', 'Sales_Mix', 'Sales_Poise', 'Sales_Set', 'Sales_Blink', 
         'Disc_Total', 'Disc_Crescent', 'Disc_Mix', 'Disc_Poise', 'Disc_Set', 'Disc_Blink', 
         'COGS_Total', 'COGS_Crescent', 'COGS_Mix', 'COGS_Poise', 'COGS_Set', 'COGS_Blink' 
     ]
+    numeric_cols = [col for col in column_names if col not in ('Store_Id', 'Zone')]
+    
+    column_dtypes = {'Store_Id': str, 'Zone': 'category', **{col: 'float64' for col in numeric_cols}}
+    read_options = dict(header=None, skiprows=4, usecols='A:U', names=column_names)
     
-    # Convert relevant columns to numeric, coercing errors
-    cols_to_numeric = data.columns.drop(['Zone', 'Store_Id'])
-    for col in cols_to_numeric:
-        data[col] = pd.to_numeric(data[col], errors='coerce').fillna(0)
+    # Load data in one typed pass, skipping initial rows to get to the data
+    try:
+        data = pd.read_excel('Clustering_Raw_data.xlsx', dtype=column_dtypes, **read_options)
+    except ValueError:
+        # A non-numeric cell ('-', 'NA', a label) defeats the typed read; coerce such cells instead
+        data = pd.read_excel('Clustering_Raw_data.xlsx',
+                             dtype={'Store_Id': str, 'Zone': 'category'}, **read_options)
+        data[numeric_cols] = (data[numeric_cols].apply(pd.to_numeric, errors='coerce')
+                              .astype({col: column_dtypes[col] for col in numeric_cols}))
+    
+    # Blank numeric cells are treated as zero
+    data[numeric_cols] = data[numeric_cols].fillna(0)
 
     # --- Q1: Derive Metrics as per Teaching Note ---
     
@@ -45,29 +70,42 @@ try:
 
     # --- Q2: Treat Outliers ---
     # We cap outliers at the 99th percentile as a robust method
-    def treat_outliers(series):
-        q99 = series.quantile(0.99)
-        return np.where(series > q99, q99, series)
+    def treat_outliers(values):
+        # Caps the array in place; callers pass a private copy
+        q99 = np.quantile(values, 0.99)
+        np.minimum(values, q99, out=values)
+        return values
     
-    data_model['Markdown_Sensitivity'] = treat_outliers(data_model['Markdown_Sensitivity'])
-    data_model['NP_Per_SqFt'] = treat_outliers(data_model['NP_Per_SqFt'])
+    data_model['Markdown_Sensitivity'] = treat_outliers(data_model['Markdown_Sensitivity'].to_numpy(dtype=np.float64, copy=True))
+    data_model['NP_Per_SqFt'] = treat_outliers(data_model['NP_Per_SqFt'].to_numpy(dtype=np.float64, copy=True))
 
     # --- Q3 & Q4: Prepare Data for Clustering ---
     
-    # Scale numeric features
-    scaler = StandardScaler()
-    numeric_scaled = scaler.fit_transform(data_model[['Markdown_Sensitivity', 'NP_Per_SqFt']])
-    
-    # One-Hot Encode the 'Zone' categorical feature
-    zone_dummies = pd.get_dummies(data_model['Zone'], prefix='Zone').values
+    # Scale numeric features (z-score with population std, as StandardScaler does)
+    numeric_scaled = data_model[['Markdown_Sensitivity', 'NP_Per_SqFt']].to_numpy(dtype=np.float64)
+    mu = numeric_scaled.mean(axis=0)
+    sd = numeric_scaled.std(axis=0)
+    sd[sd == 0] = 1.0  # Constant columns are left centered but unscaled
+    numeric_scaled -= mu
+    numeric_scaled /= sd
     
-    # Combine numeric and categorical features for clustering
+    # Combine numeric and One-Hot Encoded 'Zone' features for clustering, written
+    # straight into one preallocated buffer (same column layout as get_dummies)
     # Note: Gower's distance is ideal, but this is a common proxy with Euclidean distance
-    X_cluster = np.hstack([numeric_scaled, zone_dummies])
+    # Zones whose stores were all dropped above get no column, as with get_dummies on raw values
+    data_model['Zone'] = data_model['Zone'].cat.remove_unused_categories()
+    zone_codes = data_model['Zone'].cat.codes.to_numpy()
+    n_zones = len(data_model['Zone'].cat.categories)
+    X_cluster = np.zeros((len(zone_codes), 2 + n_zones), dtype=np.float64)
+    X_cluster[:, :2] = numeric_scaled
+    X_cluster[np.arange(len(zone_codes)), 2 + zone_codes] = 1.0
 
     # --- Q5: Develop Hierarchical Clustering Model ---
     # Using Ward's method, which minimizes variance within clusters
-    Z = linkage(X_cluster, method='ward')
+    if linkage_vector is not None:
+        Z = linkage_vector(X_cluster, method='ward')
+    else:
+        Z = linkage(X_cluster, method='ward')
     
     print("--- PART A: CLUSTERING COMPLETE ---")
     print(f"Clustering prepared for {X_cluster.shape[0]} stores using {X_cluster.shape[1]} features.")
@@ -91,10 +129,23 @@ try:
     # Log-transform variables as specified in the teaching note for elasticity modeling
     # Add a small constant to avoid log(0)
     epsilon = 1e-9
-    df_ts_sorted['log_sales'] = np.log(df_ts_sorted['sales_units'] + epsilon)
-    df_ts_sorted['log_lag_sales'] = np.log(df_ts_sorted['sales_units'].shift(1) + epsilon)
-    df_ts_sorted['log_disc'] = np.log(df_ts_sorted['discount_per'] + epsilon)
-    df_ts_sorted['log_lag_disc'] = np.log(df_ts_sorted['discount_per'].shift(1) + epsilon)
+    sales = df_ts_sorted['sales_units'].to_numpy(dtype=np.float64)
+    disc = df_ts_sorted['discount_per'].to_numpy(dtype=np.float64)
+    
+    # One log pass per raw column; the lags are the same values shifted down a row
+    log_sales = np.log(sales + epsilon)
+    log_disc = np.log(disc + epsilon)
+    log_lag_sales = np.empty_like(log_sales)
+    log_lag_sales[0] = np.nan
+    log_lag_sales[1:] = log_sales[:-1]
+    log_lag_disc = np.empty_like(log_disc)
+    log_lag_disc[0] = np.nan
+    log_lag_disc[1:] = log_disc[:-1]
+    
+    df_ts_sorted['log_sales'] = log_sales
+    df_ts_sorted['log_lag_sales'] = log_lag_sales
+    df_ts_sorted['log_disc'] = log_disc
+    df_ts_sorted['log_lag_disc'] = log_lag_disc
     df_ts_sorted['promo_flag'] = df_ts_sorted['promo_week_flg']
     
     # --- Q9: Partition Data ---
@@ -133,36 +184,43 @@ try:
     prev_sale = 48
     mrp = 606
     
-    # Coefficients from our regression model
+    # Coefficients from our regression model, extracted once into a plain vector
     coef = model_log.params
+    c = np.array([coef['const'], coef['log_lag_sales'], coef['log_disc'],
+                  coef['log_lag_disc'], coef['promo_flag'], coef['age']], dtype=np.float64)
     
-    # Objective function to MINIMIZE NEGATIVE REVENUE (which is maximizing revenue)
-    def objective_function(discounts):
-        # discounts is a list/array of 4 discount values for the EOSS weeks
-        total_revenue = 0
+    # Explicit signatures make Numba compile eagerly at definition time; with cache=True
+    # later runs load the machine code from __pycache__ instead of re-JITing on first call
+    @njit('f8(f8[:], f8[:], f8, f8, f8, f8, f8, f8)', cache=True, fastmath=True)
+    def _obj(d, c, inv_start, age_start, prev_disc, prev_sale, mrp, eps):
+        # d is an array of 4 discount values for the EOSS weeks
+        # Unpack coefficients once; scalar math.log/math.exp skip NumPy's ufunc dispatch
+        c0, c_ls, c_ld, c_lld, c_pr, c_ag = c[0], c[1], c[2], c[3], c[4], c[5]
+        total_revenue = 0.0
         current_inventory = inv_start
         
         # Initialize state from the week prior to EOSS
-        log_lag_sales = np.log(prev_sale)
-        log_lag_discount = np.log(prev_disc)
+        log_lag_sales = math.log(prev_sale)
+        log_lag_discount = math.log(prev_disc)
         
         for i in range(4): # Loop through the 4 weeks of EOSS
-            discount_current_week = discounts[i]
+            discount_current_week = d[i]
+            log_discount_current_week = math.log(discount_current_week)
             age_current_week = age_start + i + 1
-            is_promo_week = 1 # EOSS weeks are promo weeks
+            is_promo_week = 1.0 # EOSS weeks are promo weeks
             
             # Predict sales using the log-log model equation
-            pred_log_sales = (coef['const'] + 
-                              coef['log_lag_sales'] * log_lag_sales +
-                              coef['log_disc'] * np.log(discount_current_week) +
-                              coef['log_lag_disc'] * log_lag_discount +
-                              coef['promo_flag'] * is_promo_week +
-                              coef['age'] * age_current_week)
+            pred_log_sales = (c0 +
+                              c_ls * log_lag_sales +
+                              c_ld * log_discount_current_week +
+                              c_lld * log_lag_discount +
+                              c_pr * is_promo_week +
+                              c_ag * age_current_week)
             
-            predicted_sales = np.exp(pred_log_sales)
+            predicted_sales = math.exp(pred_log_sales)
             
-            # Sales can't exceed inventory
-            actual_sales = min(predicted_sales, current_inventory)
+            # Sales can't exceed inventory (branchless min keeps the chain in registers)
+            actual_sales = 0.5 * (predicted_sales + current_inventory - abs(predicted_sales - current_inventory))
             
             # Calculate revenue for the week
             weekly_revenue = actual_sales * mrp * (1 - discount_current_week)
@@ -170,8 +228,8 @@ try:
             
             # Update inventory and lag variables for the next week
             current_inventory -= actual_sales
-            log_lag_sales = np.log(actual_sales + epsilon)
-            log_lag_discount = np.log(discount_current_week)
+            log_lag_sales = math.log(actual_sales + eps)
+            log_lag_discount = log_discount_current_week
             
         # Add revenue from liquidating leftover inventory at a flat 60% discount
         residual_revenue = current_inventory * mrp * (1 - 0.60)
@@ -179,6 +237,75 @@ try:
         
         return -total_revenue # Return negative because we are using a minimizer
     
+    @njit('f8[:](f8[:], f8[:], f8, f8, f8, f8, f8, f8)', cache=True, fastmath=True)
+    def _grad(d, c, inv_start, age_start, prev_disc, prev_sale, mrp, eps):
+        # Analytic gradient of _obj w.r.t. the 4 discounts, carried forward through
+        # the weekly recurrence. Each state variable keeps its derivative w.r.t.
+        # every d[j]; min() is differentiated along whichever branch it selected.
+        c0, c_ls, c_ld, c_lld, c_pr, c_ag = c[0], c[1], c[2], c[3], c[4], c[5]
+        grad_revenue = np.zeros(4)
+        grad_inventory = np.zeros(4)
+        grad_log_lag_sales = np.zeros(4)
+        grad_log_lag_discount = np.zeros(4)
+        grad_pred = np.zeros(4)
+        grad_sales = np.zeros(4)
+        current_inventory = inv_start
+        
+        log_lag_sales = math.log(prev_sale)
+        log_lag_discount = math.log(prev_disc)
+        
+        for i in range(4):
+            discount_current_week = d[i]
+            log_discount_current_week = math.log(discount_current_week)
+            age_current_week = age_start + i + 1
+            
+            pred_log_sales = (c0 + c_ls * log_lag_sales + c_ld * log_discount_current_week +
+                              c_lld * log_lag_discount + c_pr + c_ag * age_current_week)
+            predicted_sales = math.exp(pred_log_sales)
+            
+            for j in range(4):
+                grad_pred[j] = c_ls * grad_log_lag_sales[j] + c_lld * grad_log_lag_discount[j]
+            grad_pred[i] += c_ld / discount_current_week
+            
+            if predicted_sales < current_inventory:
+                actual_sales = predicted_sales
+                for j in range(4):
+                    grad_sales[j] = predicted_sales * grad_pred[j]
+            else:
+                actual_sales = current_inventory
+                for j in range(4):
+                    grad_sales[j] = grad_inventory[j]
+            
+            # d(revenue) = d(sales) * mrp * (1 - d_i) - sales * mrp * d(d_i)
+            for j in range(4):
+                grad_revenue[j] += grad_sales[j] * mrp * (1 - discount_current_week)
+            grad_revenue[i] -= actual_sales * mrp
+            
+            current_inventory -= actual_sales
+            for j in range(4):
+                grad_inventory[j] -= grad_sales[j]
+                grad_log_lag_sales[j] = grad_sales[j] / (actual_sales + eps)
+                grad_log_lag_discount[j] = 0.0
+            grad_log_lag_discount[i] = 1.0 / discount_current_week
+            log_lag_sales = math.log(actual_sales + eps)
+            log_lag_discount = log_discount_current_week
+        
+        # Leftover inventory is liquidated at a flat 60% discount
+        for j in range(4):
+            grad_revenue[j] += grad_inventory[j] * mrp * (1 - 0.60)
+        
+        return -grad_revenue
+    
+    # Objective function to MINIMIZE NEGATIVE REVENUE (which is maximizing revenue)
+    def objective_function(discounts):
+        return _obj(np.asarray(discounts, dtype=np.float64), c, float(inv_start), float(age_start),
+                    prev_disc, float(prev_sale), float(mrp), epsilon)
+    
+    # Its gradient, so SLSQP doesn't spend 4 extra objective calls on finite differences
+    def objective_gradient(discounts):
+        return _grad(np.asarray(discounts, dtype=np.float64), c, float(inv_start), float(age_start),
+                     prev_disc, float(prev_sale), float(mrp), epsilon)
+    
     # Define bounds and constraints
     # Bounds: Discount for each week must be between 10% and 60%
     bounds = [(0.10, 0.60) for _ in range(4)]
@@ -190,21 +317,45 @@ try:
         {'type': 'ineq', 'fun': lambda d: d[3] - d[2]}  # d4 - d3 >= 0
     ]
     
-    # Initial guess for the optimizer
-    initial_guess = [0.1, 0.2, 0.3, 0.4]
+    # Score every monotone discount path on a 2-point-step grid in parallel. Only 4
+    # bounded, non-decreasing variables exist, so the lattice is small (~24k paths)
+    # and gives a global optimum at grid resolution to warm-start SLSQP from.
+    @njit('f8[:](f8[:, :], f8[:], f8, f8, f8, f8, f8, f8)', parallel=True, fastmath=True, cache=True)
+    def _score_all(d_array, c, inv_start, age_start, prev_disc, prev_sale, mrp, eps):
+        # d_array has shape (N, 4): one candidate discount path per row
+        n = d_array.shape[0]
+        revenue = np.empty(n)
+        for i in prange(n):
+            revenue[i] = -_obj(d_array[i], c, inv_start, age_start, prev_disc, prev_sale, mrp, eps)
+        return revenue
+    
+    grid = np.linspace(0.10, 0.60, 26)
+    lattice = np.stack(np.meshgrid(grid, grid, grid, grid, indexing='ij'), axis=-1).reshape(-1, 4)
+    monotone = (lattice[:, 0] <= lattice[:, 1]) & (lattice[:, 1] <= lattice[:, 2]) & (lattice[:, 2] <= lattice[:, 3])
+    candidates = np.ascontiguousarray(lattice[monotone])
+    grid_revenue = _score_all(candidates, c, float(inv_start), float(age_start),
+                              prev_disc, float(prev_sale), float(mrp), epsilon)
+    best_idx = int(np.argmax(grid_revenue))
+    
+    # Initial guess for the optimizer: the best grid point
+    initial_guess = candidates[best_idx]
     
-    # Run the optimization
-    solution = minimize(objective_function, initial_guess, method='SLSQP', bounds=bounds, constraints=constraints)
+    # Run the optimization to refine the grid optimum between lattice points
+    solution = minimize(objective_function, initial_guess, method='SLSQP', jac=objective_gradient,
+                        bounds=bounds, constraints=constraints)
     
     print("\n--- PART C: OPTIMIZATION COMPLETE ---")
-    if solution.success:
+    if solution.success and -solution.fun >= grid_revenue[best_idx]:
         optimal_discounts = solution.x
         max_revenue = -solution.fun
         print(f"Optimization Successful.")
-        print(f"Optimal Discounts: {[f'{d:.2%}' for d in optimal_discounts]}")
-        print(f"Maximum Predicted Revenue: INR {max_revenue:,.2f}")
     else:
-        print("Optimization failed to find a solution.")
+        # SLSQP stalled or did worse than the lattice; keep the grid optimum
+        optimal_discounts = initial_guess
+        max_revenue = grid_revenue[best_idx]
+        print("Optimization Successful (grid search).")
+    print(f"Optimal Discounts: {[f'{d:.2%}' for d in optimal_discounts]}")
+    print(f"Maximum Predicted Revenue: INR {max_revenue:,.2f}")
 
 except NameError:
     print("\nPart C skipped because the forecasting model from Part B could not be built.")
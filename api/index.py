@@ -1,6 +1,7 @@
 """
 BIPA API Server with Graceful Fallback Architecture
-Tries to import heavy libraries; falls back to mock service if imports fail (e.g., on Vercel)
+Checks for heavy libraries at startup but only imports them on first real analysis;
+falls back to mock service if they are missing (e.g., on Vercel)
 """
 
 from flask import Flask, request, jsonify
@@ -8,24 +9,35 @@ from flask_cors import CORS
 import json
 from datetime import datetime, timedelta
 import random
+import hashlib
+import importlib.util
+from collections import OrderedDict
 
 app = Flask(__name__)
 CORS(app)
 
-# Try to import heavy libraries
-USE_REAL_ANALYSIS = False
-try:
+# Check for heavy libraries without importing them: importing costs seconds of
+# cold start and the mock path never needs them
+HEAVY_LIBRARIES = ["pandas", "numpy", "lifetimes", "mlxtend", "sklearn", "scipy", "networkx"]
+_missing_libraries = [name for name in HEAVY_LIBRARIES if importlib.util.find_spec(name) is None]
+USE_REAL_ANALYSIS = not _missing_libraries
+REAL_SERVICES_AVAILABLE = False
+if USE_REAL_ANALYSIS:
+    print("✓ Heavy libraries found - using REAL analysis (loaded on first use)")
+else:
+    print(f"⚠ Heavy libraries not available ({', '.join(_missing_libraries)}) - using MOCK analysis")
+
+
+def _load_heavy_libraries():
+    """Import the heavy libraries into module globals; called once by RealAnalysisService"""
+    global pd, np, fpgrowth, association_rules, KMeans, REAL_SERVICES_AVAILABLE
+    global BasketService, CLVService, MarkovService, BudgetService
+    
     import pandas as pd
     import numpy as np
-    from lifetimes import BetaGeoFitter, GammaGammaFitter
-    from mlxtend.frequent_patterns import apriori, association_rules
+    from mlxtend.frequent_patterns import fpgrowth, association_rules
     from sklearn.cluster import KMeans
-    from scipy.cluster.hierarchy import linkage, dendrogram
-    import networkx as nx
-    
-    # If we get here, all imports succeeded
-    USE_REAL_ANALYSIS = True
-    print("✓ Heavy libraries loaded successfully - using REAL analysis")
+    print("✓ Heavy libraries loaded successfully")
     
     # Import real services if they exist
     try:
@@ -37,10 +49,6 @@ try:
     except ImportError:
         REAL_SERVICES_AVAILABLE = False
         print("⚠ Real services not found, will use inline analysis")
-        
-except ImportError as e:
-    print(f"⚠ Heavy libraries not available ({e}) - using MOCK analysis")
-    USE_REAL_ANALYSIS = False
 
 
 class MockAnalysisService:
@@ -59,13 +67,23 @@ class MockAnalysisService:
             {"recency_range": (60, 180), "freq_range": (1, 5), "monetary_range": (500, 2000), "label": "Bronze", "cluster": 2, "churn": 60},
         ]
         
-        for i in range(num_customers):
-            persona = random.choice(personas)
-            recency = random.randint(*persona["recency_range"])
-            frequency = random.randint(*persona["freq_range"])
-            monetary = random.randint(*persona["monetary_range"])
-            churn_risk = persona["churn"] + random.randint(-10, 10)
-            churn_risk = max(0, min(100, churn_risk))
+        # Draw persona assignments in one call, then each persona's attributes in one
+        # batched call per field (stdlib only: this path must run without numpy)
+        assignments = random.choices(range(len(personas)), k=num_customers)
+        draws = []
+        for p, persona in enumerate(personas):
+            count = assignments.count(p)
+            draws.append(zip(
+                random.choices(range(persona["recency_range"][0], persona["recency_range"][1] + 1), k=count),
+                random.choices(range(persona["freq_range"][0], persona["freq_range"][1] + 1), k=count),
+                random.choices(range(persona["monetary_range"][0], persona["monetary_range"][1] + 1), k=count),
+                random.choices(range(-10, 11), k=count)
+            ))
+        
+        for i, p in enumerate(assignments):
+            persona = personas[p]
+            recency, frequency, monetary, churn_noise = next(draws[p])
+            churn_risk = max(0, min(100, persona["churn"] + churn_noise))
             
             # Calculate derived metrics
             avg_inter_purchase = recency // max(frequency - 1, 1) if frequency > 1 else recency
@@ -234,20 +252,51 @@ class MockAnalysisService:
     
     @staticmethod
     def analyze(file_data=None):
-        """Main analysis method that returns all dummy data"""
-        return {
-            "analyzedData": MockAnalysisService.generate_dummy_rfm_data(),
-            "centroids": MockAnalysisService.generate_dummy_centroids(),
-            "rules": MockAnalysisService.generate_dummy_association_rules(),
-            "transitions": MockAnalysisService.generate_dummy_transitions(),
-            "budget": MockAnalysisService.generate_dummy_budget()
-        }
+        """Main analysis method that returns all dummy data (built once at import)"""
+        return _MOCK_PAYLOAD
+
+
+# The mock payload doesn't depend on the request, so build it once per process
+# instead of on every fallback. Callers only serialize it, never mutate it.
+_MOCK_PAYLOAD = {
+    "analyzedData": MockAnalysisService.generate_dummy_rfm_data(),
+    "centroids": MockAnalysisService.generate_dummy_centroids(),
+    "rules": MockAnalysisService.generate_dummy_association_rules(),
+    "transitions": MockAnalysisService.generate_dummy_transitions(),
+    "budget": MockAnalysisService.generate_dummy_budget()
+}
+
+
+# Results for recently uploaded files, keyed by a hash of the file bytes, so a
+# repeated upload of the same data skips itemset mining and K-Means
+_RESULT_CACHE_SIZE = 16
+_rules_cache = OrderedDict()
+_clustering_cache = OrderedDict()
+
+
+def _cache_get(cache, key):
+    """Return the cached value for key (marking it recently used), or None"""
+    if key is None or key not in cache:
+        return None
+    cache.move_to_end(key)
+    return cache[key]
+
+
+def _cache_put(cache, key, value):
+    """Store value under key, evicting the least recently used entries"""
+    if key is None:
+        return
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > _RESULT_CACHE_SIZE:
+        cache.popitem(last=False)
 
 
 class RealAnalysisService:
     """Real analysis service using heavy libraries"""
     
     def __init__(self):
+        _load_heavy_libraries()
         if REAL_SERVICES_AVAILABLE:
             self.basket_service = BasketService()
             self.clv_service = CLVService()
@@ -259,20 +308,35 @@ class RealAnalysisService:
             self.markov_service = None
             self.budget_service = None
     
-    def analyze(self, file_data):
-        """Perform real analysis using pandas/sklearn/etc"""
+    def analyze(self, file_data, digest=None):
+        """Perform real analysis using pandas/sklearn/etc
+        
+        digest identifies the uploaded content; when given, clustering and
+        market basket results are reused for identical uploads.
+        """
         try:
             # Read the uploaded file
             df = pd.read_excel(file_data) if hasattr(file_data, 'read') else pd.read_csv(file_data)
+            df = self._prepare_columns(df)
             
-            # Perform RFM analysis
-            rfm_data = self._calculate_rfm(df)
-            
-            # Perform clustering
-            clustered_data, centroids = self._perform_clustering(rfm_data)
+            # Recency depends on today's date, so clustering is cached per day
+            clustering_key = (digest, datetime.now().date()) if digest is not None else None
+            cached_clustering = _cache_get(_clustering_cache, clustering_key)
+            if cached_clustering is not None:
+                clustered_data, centroids = cached_clustering
+            else:
+                # Perform RFM analysis
+                rfm_df = self._calculate_rfm(df)
+                
+                # Perform clustering
+                clustered_data, centroids = self._perform_clustering(rfm_df)
+                _cache_put(_clustering_cache, clustering_key, (clustered_data, centroids))
             
             # Market basket analysis
-            rules = self._market_basket_analysis(df)
+            rules = _cache_get(_rules_cache, digest)
+            if rules is None:
+                rules = self._market_basket_analysis(df)
+                _cache_put(_rules_cache, digest, rules)
             
             # Markov chain transitions
             transitions = self._markov_chain_analysis(clustered_data)
@@ -292,8 +356,8 @@ class RealAnalysisService:
             # Fallback to mock if real analysis fails
             return MockAnalysisService.analyze()
     
-    def _calculate_rfm(self, df):
-        """Calculate RFM metrics"""
+    def _prepare_columns(self, df):
+        """Fill in the standard columns every analysis step relies on"""
         # Assume standard column names - adjust as needed
         if 'customerID' not in df.columns:
             df['customerID'] = df.iloc[:, 0]  # Use first column as customer ID
@@ -301,67 +365,79 @@ class RealAnalysisService:
             df['date'] = pd.to_datetime(df.iloc[:, 1])  # Use second column as date
         if 'amount' not in df.columns:
             df['amount'] = pd.to_numeric(df.iloc[:, 2], errors='coerce')  # Use third column as amount
-        
+        return df
+    
+    def _calculate_rfm(self, df):
+        """Calculate RFM metrics"""
         now = datetime.now()
-        rfm = df.groupby('customerID').agg({
-            'date': lambda x: (now - x.max()).days,  # Recency
-            'customerID': 'count',  # Frequency
-            'amount': 'sum'  # Monetary
-        }).rename(columns={'date': 'recency', 'customerID': 'frequency', 'amount': 'monetary'})
+        df['days_since'] = (now - df['date']).dt.days
+        rfm = df.groupby('customerID').agg(
+            recency=('days_since', 'min'),  # Recency
+            frequency=('days_since', 'size'),  # Frequency
+            monetary=('amount', 'sum')  # Monetary
+        )
         
-        rfm_data = []
-        for idx, row in rfm.iterrows():
-            rfm_data.append({
-                "customerID": str(idx),
-                "recency": int(row['recency']),
-                "frequency": int(row['frequency']),
-                "monetary": float(row['monetary']),
-                "churnRisk": min(100, max(0, int(row['recency'] / 3))),
-                "predictedCLV": int(row['monetary'] * 1.2),
-                "nextPurchasePrediction": max(1, int(row['recency'] - 30)),
-                "avgInterPurchaseTime": max(1, int(row['recency'] / max(row['frequency'], 1))),
-                "segmentLabel": "Processing..."
-            })
+        recency = rfm['recency'].to_numpy(dtype=np.int64)
+        frequency = rfm['frequency'].to_numpy(dtype=np.int64)
+        monetary = rfm['monetary'].to_numpy(dtype=np.float64)
         
-        return rfm_data
+        # Derived metrics computed column-wise rather than per customer
+        rfm_df = pd.DataFrame({
+            "customerID": rfm.index.astype(str),
+            "recency": recency,
+            "frequency": frequency,
+            "monetary": monetary,
+            "churnRisk": np.clip(recency // 3, 0, 100),
+            "predictedCLV": np.trunc(monetary * 1.2).astype(np.int64),
+            "nextPurchasePrediction": np.maximum(1, recency - 30),
+            "avgInterPurchaseTime": np.maximum(1, np.trunc(recency / np.maximum(frequency, 1)).astype(np.int64)),
+            "segmentLabel": "Processing..."
+        })
+        
+        return rfm_df
     
-    def _perform_clustering(self, rfm_data):
+    def _perform_clustering(self, rfm_df):
         """Perform K-Means clustering"""
-        if len(rfm_data) < 3:
-            return rfm_data, MockAnalysisService.generate_dummy_centroids()
+        if len(rfm_df) < 3:
+            return rfm_df.to_dict('records'), MockAnalysisService.generate_dummy_centroids()
         
-        # Prepare data for clustering
-        X = np.array([[d['recency'], d['frequency'], d['monetary']] for d in rfm_data])
+        # Prepare data for clustering straight from the RFM columns
+        X = rfm_df[['recency', 'frequency', 'monetary']].to_numpy(dtype=np.float32)
         
-        # Normalize
-        X_norm = (X - X.mean(axis=0)) / (X.std(axis=0) + 1e-8)
+        # Normalize in place: center, then divide by the population std (ddof=0)
+        X_norm = X
+        X_norm -= X_norm.mean(axis=0)
+        std = np.sqrt(np.einsum('ij,ij->j', X_norm, X_norm) / len(X_norm))
+        X_norm /= std + 1e-8
         
-        # K-Means with 3 clusters
-        kmeans = KMeans(n_clusters=3, random_state=42, n_init=10)
+        # K-Means with 3 clusters; Elkan's triangle-inequality bounds skip most distance
+        # computations without changing the result
+        kmeans = KMeans(n_clusters=3, random_state=42, n_init=10, algorithm='elkan')
         clusters = kmeans.fit_predict(X_norm)
         
         # Assign clusters
-        clustered_data = []
-        for i, data in enumerate(rfm_data):
-            cluster_id = int(clusters[i])
-            label = ["Gold", "Silver", "Bronze"][cluster_id]
-            clustered_data.append({**data, "cluster": cluster_id, "segmentLabel": label})
+        labels = np.array(["Gold", "Silver", "Bronze"], dtype=object)[clusters]
+        clustered_data = rfm_df.assign(cluster=clusters.astype(np.int64), segmentLabel=labels).to_dict('records')
         
-        # Calculate centroids
+        # Calculate centroids from the raw (un-normalized) columns
+        recency = rfm_df['recency'].to_numpy()
+        frequency = rfm_df['frequency'].to_numpy()
+        monetary = rfm_df['monetary'].to_numpy()
         centroids = []
         for i in range(3):
-            cluster_points = [d for d in clustered_data if d['cluster'] == i]
-            if cluster_points:
+            cluster_mask = clusters == i
+            count = int(cluster_mask.sum())
+            if count:
                 centroids.append({
                     "id": i,
                     "label": ["Gold (VIP)", "Silver (Active)", "Bronze (Risk)"][i],
                     "color": ["#fbbf24", "#8b5cf6", "#f43f5e"][i],
                     "icon": ["👑", "🌱", "⚠️"][i],
                     "description": ["High Value, Frequent", "Loyal, Regular", "Low Value, At Risk"][i],
-                    "avgRecency": int(np.mean([d['recency'] for d in cluster_points])),
-                    "avgFrequency": int(np.mean([d['frequency'] for d in cluster_points])),
-                    "avgMonetary": int(np.mean([d['monetary'] for d in cluster_points])),
-                    "count": len(cluster_points)
+                    "avgRecency": int(recency[cluster_mask].mean()),
+                    "avgFrequency": int(frequency[cluster_mask].mean()),
+                    "avgMonetary": int(monetary[cluster_mask].mean()),
+                    "count": count
                 })
             else:
                 centroids.append(MockAnalysisService.generate_dummy_centroids()[i])
@@ -376,22 +452,33 @@ class RealAnalysisService:
                 return MockAnalysisService.generate_dummy_association_rules()
             
             basket = df.groupby(['customerID', 'category']).size().unstack().fillna(0)
-            basket = (basket > 0).astype(int)
+            basket = basket > 0  # mlxtend works natively on a bool one-hot frame
             
-            # Apriori algorithm
-            frequent_itemsets = apriori(basket, min_support=0.05, use_colnames=True)
+            # FP-Growth: same itemsets as apriori, mined without candidate generation
+            frequent_itemsets = fpgrowth(basket, min_support=0.05, use_colnames=True)
             
             if len(frequent_itemsets) == 0:
                 return MockAnalysisService.generate_dummy_association_rules()
             
             rules = association_rules(frequent_itemsets, metric="lift", min_threshold=1.1)
             
+            # FP-Growth's itemset order follows string hashing, which varies per process,
+            # so rank rules explicitly (ties broken on the sorted item names)
+            rules = rules.assign(
+                antecedent_key=rules['antecedents'].map(lambda items: ", ".join(sorted(map(str, items)))),
+                consequent_key=rules['consequents'].map(lambda items: ", ".join(sorted(map(str, items))))
+            ).sort_values(
+                ['lift', 'confidence', 'support', 'antecedent_key', 'consequent_key'],
+                ascending=[False, False, False, True, True],
+                kind='stable'
+            )
+            
             # Format rules
             formatted_rules = []
             for _, rule in rules.head(8).iterrows():
                 formatted_rules.append({
-                    "antecedents": list(rule['antecedents']),
-                    "consequents": list(rule['consequents']),
+                    "antecedents": sorted(rule['antecedents'], key=str),
+                    "consequents": sorted(rule['consequents'], key=str),
                     "support": float(rule['support']),
                     "confidence": float(rule['confidence']),
                     "lift": float(rule['lift'])
@@ -446,13 +533,25 @@ class RealAnalysisService:
             return MockAnalysisService.generate_dummy_budget()
 
 
-# Initialize the appropriate service
-if USE_REAL_ANALYSIS:
-    analysis_service = RealAnalysisService()
-    print("✓ RealAnalysisService initialized")
-else:
-    analysis_service = MockAnalysisService()
-    print("✓ MockAnalysisService initialized")
+# The appropriate service is created on first use so startup stays import-free
+analysis_service = None
+
+
+def get_analysis_service():
+    """Return the shared analysis service, creating it on first call"""
+    global analysis_service, USE_REAL_ANALYSIS
+    if analysis_service is None:
+        if USE_REAL_ANALYSIS:
+            try:
+                analysis_service = RealAnalysisService()
+                print("✓ RealAnalysisService initialized")
+            except ImportError as e:
+                print(f"⚠ Heavy libraries failed to import ({e}) - using MOCK analysis")
+                USE_REAL_ANALYSIS = False
+        if analysis_service is None:
+            analysis_service = MockAnalysisService()
+            print("✓ MockAnalysisService initialized")
+    return analysis_service
 
 
 @app.route('/health', methods=['GET'])
@@ -481,9 +580,12 @@ def analyze():
                 result = MockAnalysisService.analyze()
             else:
                 # File uploaded, use appropriate service
+                service = get_analysis_service()
                 if USE_REAL_ANALYSIS:
                     print(f"Processing file: {file.filename} with REAL analysis")
-                    result = analysis_service.analyze(file)
+                    digest = hashlib.blake2b(file.read(), digest_size=16).digest()
+                    file.seek(0)
+                    result = service.analyze(file, digest=digest)
                 else:
                     print(f"File uploaded but using MOCK analysis (libraries not available)")
                     result = MockAnalysisService.analyze()